@@ -5,16 +5,20 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
@@ -22,7 +26,16 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # keep the pool at least as large as the handler threadpool (ANYIO_THREADS)
+    # so threads don't queue on connection checkout
+    # tz_aware: dates are stored as UTC and must come back marked as UTC, or
+    # clients read e.g. reminder due_at values as local time
+    _client = MongoClient(
+        database_url,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", os.getenv("ANYIO_THREADS", "200"))),
+        tz_aware=True,
+        tzinfo=timezone.utc,
+    )
     db = _client[database_name]
 
 # Helper functions for common database operations
@@ -43,6 +56,65 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     result = db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
+def create_documents(collection_name: str, items: List[Union[BaseModel, dict]]):
+    """Insert many documents with timestamps in one unordered bulk write"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    if not docs:
+        return []
+    db[collection_name].bulk_write([InsertOne(d) for d in docs], ordered=False)
+    # InsertOne assigns _id client-side
+    return [str(d["_id"]) for d in docs]
+
+def upsert_document(collection_name: str, filter_dict: dict, data: Union[BaseModel, dict]):
+    """Atomically update the document matching filter_dict, inserting it if missing"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    if isinstance(data, BaseModel):
+        data_dict = data.model_dump()
+    else:
+        data_dict = data.copy()
+
+    now = datetime.now(timezone.utc)
+    data_dict['updated_at'] = now
+
+    doc = db[collection_name].find_one_and_update(
+        filter_dict,
+        {"$set": data_dict, "$setOnInsert": {"created_at": now}},
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return str(doc["_id"])
+
+def bump_version(*collection_names: str):
+    """Increment the change counters of the given collections"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    db["meta"].bulk_write(
+        [UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in collection_names],
+        ordered=False,
+    )
+
+def get_versions(*collection_names: str):
+    """Get the change counters of the given collections as a tuple (0 if never bumped)"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    found = {d["_id"]: d["version"] for d in db["meta"].find({"_id": {"$in": list(collection_names)}})}
+    return tuple(found.get(name, 0) for name in collection_names)
+
 def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
@@ -53,3 +125,121 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
         cursor = cursor.limit(limit)
     
     return list(cursor)
+
+def _create_unique_index(collection_name: str, keys: list):
+    """Create a unique index, leaving the collection unindexed if it already holds duplicates"""
+    try:
+        db[collection_name].create_indexes([IndexModel(keys, unique=True)])
+    except OperationFailure as e:
+        if e.code == 11000:
+            # retried on next startup once the duplicates are cleaned up
+            logger.warning("Skipping unique index %s on %s: duplicate keys exist (%s)", keys, collection_name, e)
+            return
+        if e.code not in (85, 86):
+            raise
+        # IndexOptionsConflict / IndexKeySpecsConflict: a non-unique index on the
+        # same keys exists; convert it in place (MongoDB 6.0+) instead of dropping it
+        key_pattern = dict(keys)
+        try:
+            db.command("collMod", collection_name, index={"keyPattern": key_pattern, "prepareUnique": True})
+            db.command("collMod", collection_name, index={"keyPattern": key_pattern, "unique": True})
+        except OperationFailure as e:
+            logger.warning("Could not convert index %s on %s to unique (%s)", keys, collection_name, e)
+
+def ensure_indexes():
+    """Create the indexes backing the API's hot queries (idempotent)"""
+    if db is None:
+        return
+    try:
+        _ensure_indexes()
+    except PyMongoError as e:
+        # don't refuse to start when Mongo is unreachable; /test reports it and
+        # the indexes are created on the next startup
+        logger.warning("Could not ensure indexes: %s", e)
+
+def _ensure_indexes():
+    db["review"].create_indexes([IndexModel([("recipe_id", ASCENDING)])])
+    _create_unique_index("pantryitem", [("name", ASCENDING), ("unit", ASCENDING)])
+    db["pantryitem"].create_indexes([IndexModel([("name_lc", ASCENDING)])])
+    _create_unique_index("mealplan", [("week_start", ASCENDING)])
+    # TTL index: reminders are purged by the server once past due_at + grace
+    reminder_ttl_seconds = int(os.getenv("REMINDER_TTL_SECONDS", "86400"))
+    reminder_ttl = IndexModel([("due_at", ASCENDING)], expireAfterSeconds=reminder_ttl_seconds)
+    try:
+        db["reminder"].create_indexes([reminder_ttl])
+    except OperationFailure as e:
+        # IndexOptionsConflict / IndexKeySpecsConflict: an index on due_at exists
+        # with other options
+        if e.code not in (85, 86):
+            raise
+        existing = db["reminder"].index_information().get("due_at_1", {})
+        if "expireAfterSeconds" in existing:
+            # already a TTL index: change the expiry in place
+            db.command(
+                "collMod",
+                "reminder",
+                index={"keyPattern": {"due_at": 1}, "expireAfterSeconds": reminder_ttl_seconds},
+            )
+        else:
+            # plain index from before the TTL: rebuild it, tolerating other
+            # workers doing the same concurrently
+            try:
+                db["reminder"].drop_index("due_at_1")
+            except OperationFailure as e:
+                if e.code != 27:  # IndexNotFound
+                    raise
+            try:
+                db["reminder"].create_indexes([reminder_ttl])
+            except OperationFailure as e:
+                if e.code not in (85, 86):
+                    raise
+    db["recipe"].create_indexes([
+        IndexModel([("title", ASCENDING)]),
+        IndexModel([("avg_rating", DESCENDING), ("title", ASCENDING)]),
+    ])
+
+def _backfill_review_stats():
+    """Materialize review_count/_rating_sum/avg_rating on recipes reviewed before they were tracked"""
+    if db["meta"].find_one({"_id": "review_stats_backfill"}, {"_id": 1}):
+        return
+    db["review"].aggregate([
+        {"$group": {"_id": "$recipe_id", "review_count": {"$sum": 1}, "_rating_sum": {"$sum": "$rating"}}},
+        {"$project": {
+            "_id": {"$convert": {"input": "$_id", "to": "objectId", "onError": None}},
+            "review_count": 1,
+            "_rating_sum": 1,
+            "avg_rating": {"$round": [{"$divide": ["$_rating_sum", "$review_count"]}, 2]},
+        }},
+        # reviews whose recipe_id isn't an ObjectId can't belong to a recipe
+        {"$match": {"_id": {"$ne": None}}},
+        {"$merge": {"into": "recipe", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ])
+    # only recorded once the $merge has succeeded, so a failed run is retried
+    db["meta"].update_one(
+        {"_id": "review_stats_backfill"},
+        {"$setOnInsert": {"ran_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+def _convert_reminder_due_at():
+    """Turn legacy ISO-string due_at values into BSON dates so they sort and expire with the rest"""
+    # idempotent: only string values match, and unparseable ones are left as-is
+    db["reminder"].update_many(
+        {"due_at": {"$type": "string"}},
+        [{"$set": {"due_at": {"$dateFromString": {"dateString": "$due_at", "onError": "$due_at"}}}}],
+    )
+
+MIGRATIONS = (_backfill_review_stats, _convert_reminder_due_at)
+
+def run_migrations():
+    """Run one-off data migrations; call before any worker accepts traffic"""
+    # start_server.sh and main's __main__ run this ahead of uvicorn: a recount
+    # racing add_review's $inc would lose reviews
+    if db is None:
+        return
+    for migration in MIGRATIONS:
+        try:
+            migration()
+        except PyMongoError as e:
+            # not recorded as done, so it is retried on the next start
+            logger.warning("Migration %s failed: %s", migration.__name__, e)
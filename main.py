@@ -1,14 +1,38 @@
+import hashlib
 import os
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from itertools import cycle
+from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Query
+import anyio.to_thread
+import orjson
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, field_validator
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
-from database import db, create_document, get_documents
-from schemas import Recipe, PantryItem, MealPlan, Reminder, Review
+from database import (
+    db, create_document, create_documents, upsert_document, get_documents,
+    ensure_indexes, run_migrations, bump_version, get_versions,
+)
+from schemas import Recipe, RecipeIngredient, PantryItem, MealPlan, Reminder, Review
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # sync handlers run on anyio's threadpool (40 threads by default)
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = int(os.getenv("ANYIO_THREADS", "200"))
+    ensure_indexes()
+    yield
 
-app = FastAPI(title="Lulu Recipe Hub API")
+
+app = FastAPI(title="Lulu Recipe Hub API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +47,18 @@ class IdModel(BaseModel):
     id: str
 
 
+class IdsModel(BaseModel):
+    ids: List[str]
+
+    @field_validator("ids")
+    @classmethod
+    def validate_ids(cls, v):
+        bad = [i for i in v if not ObjectId.is_valid(i)]
+        if bad:
+            raise ValueError(f"Invalid ObjectId: {', '.join(bad)}")
+        return v
+
+
 # Utility helpers
 class PyObjectId(ObjectId):
     @classmethod
@@ -33,25 +69,51 @@ class PyObjectId(ObjectId):
     def validate(cls, v):
         if not ObjectId.is_valid(v):
             raise ValueError("Invalid ObjectId")
-        return ObjectId(v)
+        return _oid(v)
+
+
+@lru_cache(maxsize=4096)
+def _oid(s: str) -> ObjectId:
+    # ObjectIds are immutable, so parsed ids can be shared between requests
+    return ObjectId(s)
 
 
 def oid_str(doc: Dict[str, Any]) -> Dict[str, Any]:
+    # mutates in place: pymongo hands out a fresh dict per result
     if not doc:
         return doc
-    d = {**doc}
-    if d.get("_id") is not None:
-        d["id"] = str(d.pop("_id"))
+    _id = doc.pop("_id", None)
+    if _id is not None:
+        doc["id"] = str(_id)
     # convert nested ObjectIds if any
-    for k, v in list(d.items()):
-        if isinstance(v, ObjectId):
-            d[k] = str(v)
-    return d
+    for k in doc:
+        v = doc[k]
+        if type(v) is ObjectId:
+            doc[k] = str(v)
+    return doc
+
+
+# GET endpoints polled by the frontend answer If-None-Match with a 304 while
+# the collections they read are unchanged (per the version counters in "meta")
+CACHE_CONTROL = "private, max-age=5"
+
+
+def not_modified(request: Request, response: Response, *collections: str, salt: str = "") -> Optional[Response]:
+    key = f"{get_versions(*collections)}|{salt}|{request.url.path}?{request.url.query}"
+    etag = '"%s"' % hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
 
 
 # Root endpoints
+# Handlers that touch Mongo stay sync `def`: FastAPI already runs them in its
+# worker threadpool, keeping the event loop free. Handlers that never block are
+# `async def` so they skip the thread hop.
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Lulu Recipe Hub API running"}
 
 
@@ -76,55 +138,123 @@ def test_database():
 
 
 # ------- Recipes -------
+# write-time normalized fields used for matching, not part of the API
+RECIPE_PUBLIC_FIELDS = {"ingredients.name_lc": 0, "ingredients.substitutions_lc": 0, "_rating_sum": 0}
+# fields needed to render a recipe card
+RECIPE_SUMMARY_FIELDS = {
+    "title": 1, "image": 1, "prep_time_min": 1, "age_range": 1, "tags": 1, "avg_rating": 1, "review_count": 1,
+}
+RECIPE_SORTS = {
+    "title": [("title", 1)],
+    # backed by the (avg_rating, title) index; unrated recipes sort last
+    "rating": [("avg_rating", -1), ("title", 1)],
+}
+# documents per getMore when streaming, bounding memory held per response
+STREAM_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "200"))
+
+
 @app.get("/api/recipes")
-def list_recipes(include_reviews: bool = False):
-    items = list(db["recipe"].find().sort("title"))
-    recipes = [oid_str(i) for i in items]
-    if include_reviews:
-        for r in recipes:
-            r_reviews = list(db["review"].find({"recipe_id": r["id"]}))
-            r["reviews"] = [oid_str(rv) for rv in r_reviews]
-            if r_reviews:
-                r["avg_rating"] = round(sum(rv.get("rating", 0) for rv in r_reviews) / len(r_reviews), 2)
-            else:
-                r["avg_rating"] = None
-    return {"recipes": recipes}
+def list_recipes(
+    request: Request,
+    response: Response,
+    include_reviews: bool = False,
+    summary: bool = False,
+    sort: str = Query("title", pattern="^(title|rating)$"),
+):
+    cached = not_modified(request, response, "recipe", *(("review",) if include_reviews else ()))
+    if cached is not None:
+        return cached
+    projection = RECIPE_SUMMARY_FIELDS if summary else RECIPE_PUBLIC_FIELDS
+    if not include_reviews:
+        return {"recipes": [oid_str(i) for i in db["recipe"].find({}, projection).sort(RECIPE_SORTS[sort])]}
+    # join reviews and compute the average server-side in a single round-trip;
+    # reviews store recipe_id as a string, hence the $toString on _id
+    pipeline = [
+        {"$sort": dict(RECIPE_SORTS[sort])},
+        {"$project": projection},
+        {"$lookup": {
+            "from": "review",
+            "let": {"rid": {"$toString": "$_id"}},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$recipe_id", "$$rid"]}}},
+                {"$addFields": {"id": {"$toString": "$_id"}}},
+                {"$project": {"_id": 0}},
+            ],
+            "as": "reviews",
+        }},
+        {"$addFields": {"avg_rating": {"$cond": [
+            {"$gt": [{"$size": "$reviews"}, 0]},
+            {"$round": [{"$avg": "$reviews.rating"}, 2]},
+            None,
+        ]}}},
+    ]
+    return {"recipes": [oid_str(i) for i in db["recipe"].aggregate(pipeline)]}
+
+
+@app.get("/api/recipes/stream")
+def stream_recipes(summary: bool = False):
+    # NDJSON: one recipe per line, encoded as the cursor is consumed
+    projection = RECIPE_SUMMARY_FIELDS if summary else RECIPE_PUBLIC_FIELDS
+    cursor = db["recipe"].find({}, projection).sort("title").batch_size(STREAM_BATCH_SIZE)
+    return StreamingResponse(
+        (orjson.dumps(oid_str(doc)) + b"\n" for doc in cursor),
+        media_type="application/x-ndjson",
+    )
 
 
 @app.post("/api/recipes")
 def create_recipe(payload: Recipe):
     new_id = create_document("recipe", payload)
+    bump_version("recipe")
     return {"id": new_id}
 
 
+@app.post("/api/recipes/bulk")
+def create_recipes(payload: List[Recipe]):
+    ids = create_documents("recipe", payload)
+    if ids:
+        bump_version("recipe")
+    return {"ids": ids}
+
+
 @app.get("/api/recipes/{recipe_id}")
 def get_recipe(recipe_id: str):
-    doc = db["recipe"].find_one({"_id": ObjectId(recipe_id)})
+    doc = db["recipe"].find_one({"_id": _oid(recipe_id)}, RECIPE_PUBLIC_FIELDS)
     if not doc:
         raise HTTPException(status_code=404, detail="Recipe not found")
     r = oid_str(doc)
-    r_reviews = list(db["review"].find({"recipe_id": recipe_id}))
-    r["reviews"] = [oid_str(rv) for rv in r_reviews]
+    r["reviews"] = [oid_str(rv) for rv in db["review"].find({"recipe_id": recipe_id})]
     return r
 
 
 @app.put("/api/recipes/{recipe_id}")
 def update_recipe(recipe_id: str, payload: Recipe):
     data = payload.model_dump()
-    data["updated_at"] = __import__("datetime").datetime.utcnow()
-    result = db["recipe"].update_one({"_id": ObjectId(recipe_id)}, {"$set": data})
+    data["updated_at"] = datetime.now(timezone.utc)
+    result = db["recipe"].update_one({"_id": _oid(recipe_id)}, {"$set": data})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Recipe not found")
+    bump_version("recipe")
     return {"status": "ok"}
 
 
 @app.delete("/api/recipes/{recipe_id}")
 def delete_recipe(recipe_id: str):
-    db["recipe"].delete_one({"_id": ObjectId(recipe_id)})
+    db["recipe"].delete_one({"_id": _oid(recipe_id)})
     db["review"].delete_many({"recipe_id": recipe_id})
+    bump_version("recipe", "review")
     return {"status": "ok"}
 
 
+@app.post("/api/recipes/bulk-delete")
+def delete_recipes(payload: IdsModel):
+    oids = [_oid(rid) for rid in payload.ids]
+    result = db["recipe"].delete_many({"_id": {"$in": oids}})
+    db["review"].delete_many({"recipe_id": {"$in": [str(o) for o in oids]}})
+    bump_version("recipe", "review")
+    return {"status": "ok", "deleted": result.deleted_count}
+
+
 # Reviews
 @app.get("/api/recipes/{recipe_id}/reviews")
 def list_reviews(recipe_id: str):
@@ -136,26 +266,51 @@ def list_reviews(recipe_id: str):
 def add_review(recipe_id: str, payload: Review):
     if payload.recipe_id != recipe_id:
         raise HTTPException(status_code=400, detail="recipe_id mismatch")
+    if not ObjectId.is_valid(recipe_id) or not db["recipe"].find_one({"_id": _oid(recipe_id)}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Recipe not found")
     rid = create_document("review", payload)
+    # maintain the materialized rating incrementally; each update is atomic on
+    # the recipe document and the average is derived from the stored totals
+    db["recipe"].update_one(
+        {"_id": _oid(recipe_id)},
+        {"$inc": {"review_count": 1, "_rating_sum": payload.rating}},
+    )
+    db["recipe"].update_one(
+        {"_id": _oid(recipe_id)},
+        [{"$set": {"avg_rating": {"$round": [{"$divide": ["$_rating_sum", "$review_count"]}, 2]}}}],
+    )
+    bump_version("review", "recipe")
     return {"id": rid}
 
 
 # Pantry
 @app.get("/api/pantry")
-def get_pantry():
-    items = [oid_str(d) for d in db["pantryitem"].find().sort("name")]
+def get_pantry(request: Request, response: Response):
+    cached = not_modified(request, response, "pantryitem")
+    if cached is not None:
+        return cached
+    items = [oid_str(d) for d in db["pantryitem"].find({}, {"name_lc": 0}).sort("name")]
     return {"items": items}
 
 
 @app.post("/api/pantry")
 def add_pantry_item(item: PantryItem):
-    # merge if same name+unit
-    existing = db["pantryitem"].find_one({"name": item.name, "unit": item.unit})
-    if existing:
-        db["pantryitem"].update_one({"_id": existing["_id"]}, {"$inc": {"quantity": item.quantity}})
-        return {"id": str(existing["_id"]) }
-    new_id = create_document("pantryitem", item)
-    return {"id": new_id}
+    # merge if same name+unit; the unique (name, unit) index makes the server
+    # retry a racing upsert as an update, so concurrent adds land on one item
+    now = datetime.now(timezone.utc)
+    doc = db["pantryitem"].find_one_and_update(
+        {"name": item.name, "unit": item.unit},
+        {
+            "$inc": {"quantity": item.quantity},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"image": item.image, "name_lc": item.name_lc, "created_at": now},
+        },
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    bump_version("pantryitem")
+    return {"id": str(doc["_id"])}
 
 
 class PantryUpdate(BaseModel):
@@ -168,93 +323,146 @@ def update_pantry(item_id: str, update: PantryUpdate):
     upd = {k: v for k, v in update.model_dump().items() if v is not None}
     if not upd:
         return {"status": "noop"}
-    db["pantryitem"].update_one({"_id": ObjectId(item_id)}, {"$set": upd})
+    try:
+        db["pantryitem"].update_one({"_id": _oid(item_id)}, {"$set": upd})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Pantry item with this name and unit already exists")
+    bump_version("pantryitem")
     return {"status": "ok"}
 
 
 @app.delete("/api/pantry/{item_id}")
 def remove_pantry(item_id: str):
-    db["pantryitem"].delete_one({"_id": ObjectId(item_id)})
+    db["pantryitem"].delete_one({"_id": _oid(item_id)})
+    bump_version("pantryitem")
     return {"status": "ok"}
 
 
 # Suggestions and can-make
+# (pantry/recipe versions, expiry, suggestions); reused while both versions match
+_suggest_cache = ((None, None), 0.0, None)
+SUGGEST_CACHE_TTL = float(os.getenv("SUGGEST_CACHE_TTL", "5"))
+
+
+def _norm(expr):
+    # lowercase + trim, treating a missing value as ""
+    return {"$toLower": {"$trim": {"input": {"$ifNull": [expr, ""]}}}}
+
+
+def _lc(field, source):
+    # prefer the write-time normalized field; normalize documents predating it
+    return {"$ifNull": [field, _norm(source)]}
+
+
 @app.get("/api/suggest")
 def suggest_recipes():
-    pantry = list(db["pantryitem"].find())
-    have = set(i["name"].strip().lower() for i in pantry)
+    global _suggest_cache
+    versions = get_versions("pantryitem", "recipe")
+    cached_versions, expires, cached = _suggest_cache
+    if cached_versions == versions and time.monotonic() < expires:
+        return {"suggestions": cached}
+    pipeline = [
+        {"$project": {
+            "title": 1,
+            "image": 1,
+            "ingredients.name": 1,
+            "ingredients.name_lc": 1,
+            "ingredients.substitutions": 1,
+            "ingredients.substitutions_lc": 1,
+        }},
+        # uncorrelated, so the server evaluates it (and the normalization) once
+        {"$lookup": {
+            "from": "pantryitem",
+            "pipeline": [{"$group": {"_id": None, "have": {"$addToSet": _lc("$name_lc", "$name")}}}],
+            "as": "pantry",
+        }},
+        {"$addFields": {"have": {"$ifNull": [{"$arrayElemAt": ["$pantry.have", 0]}, []]}}},
+        {"$project": {
+            "title": 1,
+            "image": 1,
+            "needed": {"$map": {
+                "input": {"$filter": {
+                    "input": {"$ifNull": ["$ingredients", []]},
+                    "as": "ing",
+                    "cond": {"$and": [
+                        {"$not": [{"$in": [_lc("$$ing.name_lc", "$$ing.name"), "$have"]}]},
+                        {"$eq": [{"$size": {"$setIntersection": [
+                            {"$ifNull": ["$$ing.substitutions_lc", {"$map": {
+                                "input": {"$ifNull": ["$$ing.substitutions", []]},
+                                "as": "s",
+                                "in": _norm("$$s"),
+                            }}]},
+                            "$have",
+                        ]}}, 0]},
+                    ]},
+                }},
+                "as": "ing",
+                "in": "$$ing.name",
+            }},
+        }},
+        {"$addFields": {
+            "missing_count": {"$size": "$needed"},
+            "can_make": {"$eq": [{"$size": "$needed"}, 0]},
+        }},
+        {"$sort": {"missing_count": 1, "title": 1}},
+    ]
     suggestions = []
-    for doc in db["recipe"].find():
-        needed = []
-        for ing in doc.get("ingredients", []):
-            name = (ing.get("name") or "").strip().lower()
-            subs = [s.strip().lower() for s in ing.get("substitutions", [])]
-            if name in have or any(s in have for s in subs):
-                continue
-            needed.append(ing.get("name"))
-        can_make = len(needed) == 0
+    for doc in db["recipe"].aggregate(pipeline):
         suggestions.append({
             "id": str(doc["_id"]),
             "title": doc.get("title"),
             "image": doc.get("image"),
-            "needed": needed,
-            "can_make": can_make,
-            "missing_count": len(needed),
+            "needed": doc["needed"],
+            "can_make": doc["can_make"],
+            "missing_count": doc["missing_count"],
         })
-    suggestions.sort(key=lambda x: (x["missing_count"], x["title"]))
+    _suggest_cache = (versions, time.monotonic() + SUGGEST_CACHE_TTL, suggestions)
     return {"suggestions": suggestions}
 
 
 # Meal Plans
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+SLOTS = ("breakfast", "lunch", "dinner")
+_EMPTY_DAY = dict.fromkeys(SLOTS)
+
+
+def empty_days() -> Dict[str, Dict[str, Optional[str]]]:
+    return {d: _EMPTY_DAY.copy() for d in DAYS}
+
+
 @app.get("/api/mealplan/{week_start}")
-def get_meal_plan(week_start: str):
+def get_meal_plan(week_start: str, request: Request, response: Response):
+    cached = not_modified(request, response, "mealplan")
+    if cached is not None:
+        return cached
     doc = db["mealplan"].find_one({"week_start": week_start})
     if not doc:
         # create empty template
-        empty = {
-            "week_start": week_start,
-            "days": {d: {"breakfast": None, "lunch": None, "dinner": None} for d in [
-                "Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"
-            ]}
-        }
-        return empty
+        return {"week_start": week_start, "days": empty_days()}
     return oid_str(doc)
 
 
 @app.post("/api/mealplan")
 def save_meal_plan(plan: MealPlan):
-    existing = db["mealplan"].find_one({"week_start": plan.week_start})
-    data = plan.model_dump()
-    if existing:
-        db["mealplan"].update_one({"_id": existing["_id"]}, {"$set": data})
-        return {"id": str(existing["_id"]) }
-    new_id = create_document("mealplan", data)
+    new_id = upsert_document("mealplan", {"week_start": plan.week_start}, plan)
+    bump_version("mealplan")
     return {"id": new_id}
 
 
 @app.post("/api/mealplan/{week_start}/auto-fill")
 def auto_fill_mealplan(week_start: str):
-    # choose recipes you can make first, then others
-    sug = suggest_recipes()["suggestions"]
-    can = [s["id"] for s in sug if s["can_make"]]
-    others = [s["id"] for s in sug if not s["can_make"]]
-    order = can + others
-    days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-    slots = ["breakfast", "lunch", "dinner"]
-    plan = {d: {s: None for s in slots} for d in days}
-    idx = 0
+    # suggestions come sorted by missing_count, so recipes you can make lead
+    order = [s["id"] for s in suggest_recipes()["suggestions"]]
+    plan = empty_days()
     if not order:
         return {"days": plan}
-    for d in days:
-        for s in slots:
-            plan[d][s] = order[idx % len(order)]
-            idx += 1
-    existing = db["mealplan"].find_one({"week_start": week_start})
+    picks = cycle(order)
+    for d in DAYS:
+        for s in SLOTS:
+            plan[d][s] = next(picks)
     data = {"week_start": week_start, "days": plan}
-    if existing:
-        db["mealplan"].update_one({"_id": existing["_id"]}, {"$set": data})
-    else:
-        create_document("mealplan", data)
+    upsert_document("mealplan", {"week_start": week_start}, data)
+    bump_version("mealplan")
     return data
 
 
@@ -270,10 +478,8 @@ def generate_shopping_list(week_start: str):
             if rid:
                 recipe_ids.add(rid)
     ingredients_needed: Dict[str, Dict[str, Any]] = {}
-    for rid in recipe_ids:
-        r = db["recipe"].find_one({"_id": ObjectId(rid)})
-        if not r:
-            continue
+    oids = [_oid(rid) for rid in recipe_ids]
+    for r in db["recipe"].find({"_id": {"$in": oids}}, {"ingredients": 1}):
         for ing in r.get("ingredients", []):
             name = ing.get("name")
             unit = ing.get("unit")
@@ -282,9 +488,8 @@ def generate_shopping_list(week_start: str):
             if key not in ingredients_needed:
                 ingredients_needed[key] = {"name": name, "unit": unit, "quantity": 0}
             ingredients_needed[key]["quantity"] += qty
-    pantry = list(db["pantryitem"].find())
     have = {}
-    for p in pantry:
+    for p in db["pantryitem"].find({}, {"_id": 0, "name": 1, "unit": 1, "quantity": 1}):
         key = f"{p.get('name')}|{p.get('unit')}"
         have[key] = have.get(key, 0) + float(p.get("quantity", 0))
     result = []
@@ -298,7 +503,11 @@ def generate_shopping_list(week_start: str):
 
 # Reminders
 @app.get("/api/reminders")
-def list_reminders():
+def list_reminders(request: Request, response: Response):
+    # TTL expiry removes reminders without a version bump; the count catches it
+    cached = not_modified(request, response, "reminder", salt=str(db["reminder"].estimated_document_count()))
+    if cached is not None:
+        return cached
     items = [oid_str(d) for d in db["reminder"].find().sort("due_at")]
     return {"reminders": items}
 
@@ -306,12 +515,14 @@ def list_reminders():
 @app.post("/api/reminders")
 def create_reminder(rem: Reminder):
     rid = create_document("reminder", rem)
+    bump_version("reminder")
     return {"id": rid}
 
 
 @app.delete("/api/reminders/{reminder_id}")
 def delete_reminder(reminder_id: str):
-    db["reminder"].delete_one({"_id": ObjectId(reminder_id)})
+    db["reminder"].delete_one({"_id": _oid(reminder_id)})
+    bump_version("reminder")
     return {"status": "ok"}
 
 
@@ -322,7 +533,7 @@ def seed_recipes():
     if count >= 25:
         return {"status": "ok", "message": "Recipes already seeded", "count": count}
     sample_recipes = []
-    base_ings = [
+    base_ings = [RecipeIngredient(**i).model_dump() for i in [
         {"name": "Apple", "quantity": 1, "unit": "pc", "substitutions": ["Pear"]},
         {"name": "Banana", "quantity": 1, "unit": "pc", "substitutions": ["Avocado"]},
         {"name": "Oatmeal", "quantity": 30, "unit": "g", "substitutions": ["Rice Cereal"]},
@@ -333,7 +544,7 @@ def seed_recipes():
         {"name": "Peas", "quantity": 60, "unit": "g", "substitutions": ["Green Beans"]},
         {"name": "Chicken", "quantity": 80, "unit": "g", "substitutions": ["Turkey"]},
         {"name": "Rice", "quantity": 30, "unit": "g", "substitutions": ["Quinoa"]},
-    ]
+    ]]
     images = [
         "https://images.unsplash.com/photo-1512621776951-a57141f2eefd",
         "https://images.unsplash.com/photo-1490474418585-ba9bad8fd0ea",
@@ -357,11 +568,23 @@ def seed_recipes():
             ],
             "tags": ["easy", "smooth"],
         })
-    db["recipe"].insert_many(sample_recipes)
+    create_documents("recipe", sample_recipes)
+    bump_version("recipe")
     return {"status": "ok", "inserted": len(sample_recipes)}
 
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # data migrations run once here, before any worker accepts traffic
+    run_migrations()
+    # workers need an import string; each spawned worker imports main (and
+    # database) afresh, so every process gets its own MongoClient pool
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.getenv("UVICORN_WORKERS", "4")),
+        loop="uvloop",
+        http="httptools",
+    )
@@ -5,8 +5,9 @@ Each Pydantic model represents a MongoDB collection. Collection name is the
 lowercase of the class name by convention in this project helper.
 """
 from __future__ import annotations
+from datetime import datetime
 from typing import List, Optional, Dict
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 
 
 class Ingredient(BaseModel):
@@ -23,6 +24,17 @@ class RecipeIngredient(BaseModel):
     image: Optional[str] = None
     substitutions: List[str] = Field(default_factory=list)
 
+    # normalized copies for case-insensitive matching; dumped to Mongo, not inputs
+    @computed_field
+    @property
+    def name_lc(self) -> str:
+        return self.name.strip().lower()
+
+    @computed_field
+    @property
+    def substitutions_lc(self) -> List[str]:
+        return [s.strip().lower() for s in self.substitutions]
+
 
 class Recipe(BaseModel):
     title: str
@@ -47,6 +59,11 @@ class PantryItem(BaseModel):
     unit: Optional[str] = None
     image: Optional[str] = None
 
+    @computed_field
+    @property
+    def name_lc(self) -> str:
+        return self.name.strip().lower()
+
 
 class MealSlot(BaseModel):
     breakfast: Optional[str] = None  # recipe_id
@@ -68,6 +85,6 @@ class ShoppingItem(BaseModel):
 
 class Reminder(BaseModel):
     title: str
-    due_at: str  # ISO datetime string
+    due_at: datetime  # stored as a BSON date; expires via TTL index
     type: str = Field("meal", description="meal | shopping | other")
     notes: Optional[str] = None